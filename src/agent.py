@@ -1,6 +1,10 @@
+import asyncio
 import logging
-import json
+import time
+from typing import Final, Optional
+
 import aiohttp
+import orjson
 
 from dotenv import load_dotenv
 from livekit.agents import (
@@ -16,6 +20,7 @@ from livekit.agents import (
     WorkerOptions,
     cli,
     metrics,
+    utils,
 )
 from livekit.agents.llm import function_tool
 from livekit.plugins import noise_cancellation, openai, silero
@@ -25,28 +30,71 @@ logger = logging.getLogger("agent")
 
 load_dotenv(".env.local")
 
+# Used by Assistant when no custom instructions are given
+DEFAULT_INSTRUCTIONS: Final[str] = """You are a helpful voice AI assistant.
+            You eagerly assist users with their questions by providing information from your extensive knowledge.
+            Your responses are concise, to the point, and without any complex formatting or punctuation including emojis, asterisks, or other symbols.
+            You are curious, friendly, and have a sense of humor."""
+
+# Used when the instruction API has no instruction for the room
+FALLBACK_INSTRUCTION: Final[str] = "You are a helpful voice AI assistant."
 
-async def fetch_room_metadata(room_name: str) -> dict:
+
+API_TIMEOUT = aiohttp.ClientTimeout(total=2.0, connect=0.5)
+API_RETRY_DELAY = 0.1
+
+
+async def _get_json(
+    session: aiohttp.ClientSession, url: str, params: dict, retries: int = 1
+) -> Optional[dict]:
+    """
+    GET a JSON object from the API, retrying connection errors, timeouts and 5xx responses.
+    Returns None if the request fails.
+    """
+    for attempt in range(retries + 1):
+        if attempt:
+            await asyncio.sleep(API_RETRY_DELAY)
+        try:
+            async with session.get(url, params=params, timeout=API_TIMEOUT) as response:
+                if response.status != 200:
+                    logger.error(f"GET {url} failed: HTTP {response.status}")
+                    if response.status < 500:
+                        return None
+                    continue
+                data = await response.json(loads=orjson.loads)
+        except (aiohttp.ContentTypeError, ValueError, LookupError) as e:
+            # retrying won't fix the body: bad content type (a ClientError), bad
+            # charset (LookupError) or undecodable text/JSON (ValueError)
+            logger.error(f"GET {url} returned invalid JSON: {e}")
+            return None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"GET {url} failed: {e!r}")
+            continue
+
+        if not isinstance(data, dict):
+            logger.error(f"GET {url} returned unexpected JSON: {data!r}")
+            return None
+        return data
+
+    return None
+
+
+async def fetch_room_metadata(room_name: str, session: aiohttp.ClientSession) -> dict:
     """Fetch room metadata from the API"""
     url = f"https://api.builder.holofair.io/api/livekit/rooms/metadata"
     params = {"roomName": room_name}
-    
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params=params) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    logger.info(f"Fetched metadata for room {room_name}: {data}")
-                    return data
-                else:
-                    logger.error(f"Failed to fetch metadata for room {room_name}: HTTP {response.status}")
-                    return {}
-    except Exception as e:
-        logger.error(f"Error fetching metadata for room {room_name}: {e}")
+
+    data = await _get_json(session, url, params)
+    if data is None:
+        logger.error(f"Failed to fetch metadata for room {room_name}")
         return {}
+    logger.info(f"Fetched metadata for room {room_name}: {data}")
+    return data
 
 
-async def fetch_instruction(instruction_id: int, metaverse_id: int = 1) -> tuple[str, list]:
+async def fetch_instruction(
+    instruction_id: int, metaverse_id: int, session: aiohttp.ClientSession
+) -> tuple[str, list]:
     """
     Fetch instruction text and MCP servers from the API
     Returns (instruction_text, mcp_servers_config)
@@ -56,26 +104,70 @@ async def fetch_instruction(instruction_id: int, metaverse_id: int = 1) -> tuple
         "instruction_id": instruction_id,
         "metaverse_id": metaverse_id
     }
-    
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params=params) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    # Extract instruction text
-                    instruction_text = data.get("instruction", "You are a helpful voice AI assistant.")
-                    
-                    # Extract MCP servers configuration
-                    mcp_servers_config = data.get("mcp_servers", [])
-                    logger.info(f"Fetched instruction and {len(mcp_servers_config)} MCP servers for instruction_id: {instruction_id}")
-                    
-                    return instruction_text, mcp_servers_config
-                else:
-                    logger.error(f"Failed to fetch instruction: HTTP {response.status}")
-                    return "You are a helpful voice AI assistant.", []
-    except Exception as e:
-        logger.error(f"Error fetching instruction: {e}")
-        return "You are a helpful voice AI assistant.", []
+
+    data = await _get_json(session, url, params)
+    if data is None:
+        logger.error(
+            f"Failed to fetch instruction for instruction_id: {instruction_id}"
+        )
+        return FALLBACK_INSTRUCTION, []
+
+    # Extract instruction text
+    instruction_text = data.get("instruction")
+    if instruction_text is None:
+        instruction_text = FALLBACK_INSTRUCTION
+    elif not isinstance(instruction_text, str):
+        logger.error(
+            f"Invalid instruction for instruction_id {instruction_id}: {instruction_text!r}"
+        )
+        instruction_text = FALLBACK_INSTRUCTION
+
+    # Extract MCP servers configuration
+    mcp_servers_config = data.get("mcp_servers") or []
+    if not isinstance(mcp_servers_config, list):
+        logger.error(
+            f"Invalid mcp_servers for instruction_id {instruction_id}: {mcp_servers_config!r}"
+        )
+        mcp_servers_config = []
+
+    logger.info(
+        f"Fetched instruction and {len(mcp_servers_config)} MCP servers for instruction_id: {instruction_id}"
+    )
+
+    return instruction_text, mcp_servers_config
+
+
+# Config fields passed through to the MCP server configuration as-is
+MCP_OPTIONAL_FIELDS: Final = frozenset({"headers", "env"})
+
+
+def _validate_mcp(config: dict) -> Optional[dict]:
+    """
+    Build an MCP server configuration from a single API config entry.
+    Returns None if the entry is invalid.
+    """
+    name = url = None
+    if isinstance(config, dict):
+        name, url = config.get("name"), config.get("url")
+    if not name or not url:
+        logger.warning(f"Invalid MCP server config: {config}")
+        return None
+
+    # Create MCP server configuration
+    # Note: The exact implementation depends on the LiveKit Agents MCP API
+    # This is a placeholder structure that should be adapted to the actual API
+    mcp_server_config = {
+        "name": name,
+        "transport": config.get("transport", "websocket"),
+        "url": url,
+    }
+
+    # Add additional config fields if present
+    mcp_server_config.update(
+        (key, config[key]) for key in MCP_OPTIONAL_FIELDS.intersection(config)
+    )
+
+    return mcp_server_config
 
 
 def create_mcp_servers(mcp_servers_config: list) -> list:
@@ -83,74 +175,58 @@ def create_mcp_servers(mcp_servers_config: list) -> list:
     Create MCP server instances from configuration
     Expected config format: [{"name": "server1", "transport": "websocket", "url": "wss://..."}]
     """
-    mcp_servers = []
-    
-    for config in mcp_servers_config:
-        try:
-            name = config.get("name")
-            transport = config.get("transport", "websocket")
-            url = config.get("url")
-            
-            if not name or not url:
-                logger.warning(f"Invalid MCP server config: {config}")
-                continue
-            
-            # Create MCP server configuration
-            # Note: The exact implementation depends on the LiveKit Agents MCP API
-            # This is a placeholder structure that should be adapted to the actual API
-            mcp_server_config = {
-                "name": name,
-                "transport": transport,
-                "url": url,
-            }
-            
-            # Add additional config fields if present
-            if "headers" in config:
-                mcp_server_config["headers"] = config["headers"]
-            if "env" in config:
-                mcp_server_config["env"] = config["env"]
-            
-            mcp_servers.append(mcp_server_config)
-            logger.info(f"Added MCP server: {name} ({transport}): {url}")
-            
-        except Exception as e:
-            logger.error(f"Error creating MCP server from config {config}: {e}")
-            continue
-    
+    mcp_servers = [
+        server
+        for config in mcp_servers_config
+        if (server := _validate_mcp(config)) is not None
+    ]
+
+    if mcp_servers:
+        logger.info(
+            "MCP servers configured: "
+            + ", ".join(
+                f"{s['name']} ({s['transport']}): {s['url']}" for s in mcp_servers
+            )
+        )
+
     return mcp_servers
 
 
+def _as_int(value: object, default: int) -> int:
+    """Convert a metadata value to int, returning default if it isn't a valid integer"""
+    # JSON true/false decode to bool, which int() would accept as 1/0
+    if isinstance(value, bool):
+        return default
+    # orjson already decodes JSON numbers to int, skip the conversion for those
+    if isinstance(value, int):
+        return value
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return default
+
+
 def should_join_room(metadata: dict) -> tuple[bool, int, int]:
     """
     Check if the agent should join the room based on metadata.
     Returns (should_join, instruction_id, metaverse_id)
     """
-    try:
-        instruction_id = metadata.get("instruction_id")
-        metaverse_id = metadata.get("metaverse_id", 1)  # Default to 1 if not specified
-        
-        # Check if instruction_id exists and is greater than 0
-        if instruction_id is not None:
-            instruction_id = int(instruction_id)
-            if instruction_id > 0:
-                return True, instruction_id, int(metaverse_id)
-        
-        return False, 0, 1
-    except (ValueError, TypeError) as e:
-        logger.error(f"Error parsing metadata: {e}")
+    # Only join rooms with an instruction_id greater than 0
+    instruction_id = _as_int(metadata.get("instruction_id"), 0)
+    if instruction_id <= 0:
         return False, 0, 1
 
+    # Default to 1 if not specified or invalid
+    metaverse_id = _as_int(metadata.get("metaverse_id", 1), 1)
+
+    return True, instruction_id, metaverse_id
+
 
 class Assistant(Agent):
     def __init__(self, instructions: str = None, mcp_servers: list = None) -> None:
         # Use custom instructions if provided, otherwise use default
-        default_instructions = """You are a helpful voice AI assistant.
-            You eagerly assist users with their questions by providing information from your extensive knowledge.
-            Your responses are concise, to the point, and without any complex formatting or punctuation including emojis, asterisks, or other symbols.
-            You are curious, friendly, and have a sense of humor."""
-        
         super().__init__(
-            instructions=instructions or default_instructions,
+            instructions=instructions or DEFAULT_INSTRUCTIONS,
             mcp_servers=mcp_servers,
         )
 
@@ -171,6 +247,25 @@ class Assistant(Agent):
         return "sunny with a temperature of 70 degrees."
 
 
+METRICS_LOG_INTERVAL = 0.5
+
+
+def _log_metrics_throttled(
+    last_logged: dict[type, float], agent_metrics: metrics.AgentMetrics
+) -> None:
+    """
+    Log agent_metrics unless metrics of the same type were logged in the last
+    METRICS_LOG_INTERVAL seconds. last_logged maps each metrics type to the
+    time it was last logged, so frequent types (e.g. VAD) can't crowd out the
+    latency metrics of other types.
+    """
+    now = time.monotonic()
+    kind = type(agent_metrics)
+    if now - last_logged.get(kind, float("-inf")) >= METRICS_LOG_INTERVAL:
+        last_logged[kind] = now
+        metrics.log_metrics(agent_metrics)
+
+
 def prewarm(proc: JobProcess):
     proc.userdata["vad"] = silero.VAD.load()
 
@@ -180,7 +275,11 @@ async def entrypoint(ctx: JobContext):
     room_name = ctx.room.name
     logger.info(f"Fetching metadata for room: {room_name}")
     
-    metadata = await fetch_room_metadata(room_name)
+    # Both API calls share the job's pooled HTTP session so the instruction
+    # request reuses the warm connection opened for the metadata request.
+    # The framework closes it when the job shuts down.
+    http_session = utils.http_context.http_session()
+    metadata = await fetch_room_metadata(room_name, http_session)
     
     # Check if agent should join this room
     should_join, instruction_id, metaverse_id = should_join_room(metadata)
@@ -192,13 +291,15 @@ async def entrypoint(ctx: JobContext):
     logger.info(f"Joining room {room_name} with instruction_id: {instruction_id}, metaverse_id: {metaverse_id}")
     
     # Fetch custom instructions and MCP servers from API
-    custom_instructions, mcp_servers_config = await fetch_instruction(instruction_id, metaverse_id)
-    
+    custom_instructions, mcp_servers_config = await fetch_instruction(
+        instruction_id, metaverse_id, http_session
+    )
+
     # Create MCP server instances
     mcp_servers = create_mcp_servers(mcp_servers_config)
-    
+
     logger.info(f"Using {len(mcp_servers)} MCP servers for this session")
-    
+
     # Logging setup
     # Add any other context you want in all log entries here
     ctx.log_context_fields = {
@@ -210,12 +311,12 @@ async def entrypoint(ctx: JobContext):
         # VAD and turn detection are used to determine when the user is speaking and when the agent should respond
         # See more at https://docs.livekit.io/agents/build/turns
         turn_detection=EnglishModel(),
-        vad=silero.VAD.load(),
+        vad=ctx.proc.userdata["vad"],
         # allow the LLM to generate a response while waiting for the end of turn
         # See more at https://docs.livekit.io/agents/build/audio/#preemptive-generation
         preemptive_generation=True,
         # See all providers at https://docs.livekit.io/agents/integrations/realtime/
-        llm=openai.realtime.RealtimeModel(voice="marin")
+        llm=openai.realtime.RealtimeModel(voice="marin"),
     )
 
     # sometimes background noise could interrupt the agent session, these are considered false positive interruptions
@@ -227,12 +328,15 @@ async def entrypoint(ctx: JobContext):
 
     # Metrics collection, to measure pipeline performance
     # For more information, see https://docs.livekit.io/agents/build/metrics/
+    # Every event is collected for the usage summary, but logging is throttled
+    # per metrics type
     usage_collector = metrics.UsageCollector()
+    last_metrics_log: dict[type, float] = {}
 
     @session.on("metrics_collected")
     def _on_metrics_collected(ev: MetricsCollectedEvent):
-        metrics.log_metrics(ev.metrics)
         usage_collector.collect(ev.metrics)
+        _log_metrics_throttled(last_metrics_log, ev.metrics)
 
     async def log_usage():
         summary = usage_collector.get_summary()
@@ -1,8 +1,19 @@
+import asyncio
+
+import aiohttp
 import pytest
-from livekit.agents import AgentSession, llm, mock_tools
+from livekit.agents import AgentSession, llm, metrics, mock_tools
 from livekit.plugins import openai
 
-from agent import Assistant
+from agent import (
+    FALLBACK_INSTRUCTION,
+    Assistant,
+    _get_json,
+    _log_metrics_throttled,
+    create_mcp_servers,
+    fetch_instruction,
+    should_join_room,
+)
 
 
 def _llm() -> llm.LLM:
@@ -221,3 +232,151 @@ async def test_refuses_harmful_request() -> None:
 
         # Ensures there are no function calls or other unexpected events
         result.expect.no_more_events()
+
+
+def test_create_mcp_servers_skips_invalid_configs() -> None:
+    """Invalid entries are dropped and optional fields are carried over."""
+    servers = create_mcp_servers(
+        [
+            {"name": "tools", "url": "wss://mcp.example.com", "headers": {"a": "b"}},
+            {"name": "no-url"},
+            {"url": "wss://no-name.example.com"},
+            "not-a-dict",
+        ]
+    )
+    assert servers == [
+        {
+            "name": "tools",
+            "transport": "websocket",
+            "url": "wss://mcp.example.com",
+            "headers": {"a": "b"},
+        }
+    ]
+
+
+@pytest.mark.parametrize(
+    ("metadata", "expected"),
+    [
+        ({}, (False, 0, 1)),
+        ({"instruction_id": 0}, (False, 0, 1)),
+        ({"instruction_id": "abc"}, (False, 0, 1)),
+        ({"instruction_id": "7"}, (True, 7, 1)),
+        ({"instruction_id": 7, "metaverse_id": 3}, (True, 7, 3)),
+        ({"instruction_id": 7, "metaverse_id": None}, (True, 7, 1)),
+        ({"instruction_id": True}, (False, 0, 1)),
+        ({"instruction_id": 7, "metaverse_id": True}, (True, 7, 1)),
+    ],
+)
+def test_should_join_room(metadata: dict, expected: tuple[bool, int, int]) -> None:
+    """Rooms are joined only with a positive instruction_id, metaverse_id falls back to 1."""
+    assert should_join_room(metadata) == expected
+
+
+class _FakeResponse:
+    def __init__(self, data: object = None, status: int = 200) -> None:
+        self.status = status
+        self._data = data
+
+    async def json(self, loads=None) -> object:
+        if isinstance(self._data, BaseException):
+            raise self._data
+        return self._data
+
+    async def __aenter__(self) -> "_FakeResponse":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        return None
+
+
+class _FakeSession:
+    """Replays one response per GET, raising it instead if it is an exception."""
+
+    def __init__(self, *responses: object) -> None:
+        self._responses = list(responses)
+        self.requests = 0
+
+    def get(self, url: str, **kwargs) -> _FakeResponse:
+        self.requests += 1
+        response = self._responses.pop(0)
+        if isinstance(response, BaseException):
+            raise response
+        return response
+
+
+_METADATA = {"instruction_id": 1}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ("responses", "expected", "requests"),
+    [
+        ((_FakeResponse(status=503), _FakeResponse(_METADATA)), _METADATA, 2),
+        ((aiohttp.ClientConnectionError(), _FakeResponse(_METADATA)), _METADATA, 2),
+        ((asyncio.TimeoutError(), _FakeResponse(_METADATA)), _METADATA, 2),
+        ((_FakeResponse(status=404),), None, 1),
+        ((_FakeResponse(status=500), aiohttp.ClientConnectionError()), None, 2),
+        ((_FakeResponse(UnicodeDecodeError("utf-8", b"\xff", 0, 1, "bad")),), None, 1),
+    ],
+    ids=[
+        "retry-5xx",
+        "retry-client-error",
+        "retry-timeout",
+        "no-retry-4xx",
+        "give-up-after-retry",
+        "no-retry-bad-body",
+    ],
+)
+async def test_get_json_retries_transient_failures(
+    monkeypatch: pytest.MonkeyPatch,
+    responses: tuple,
+    expected: object,
+    requests: int,
+) -> None:
+    """Transient failures are retried once, permanent ones return None right away."""
+    monkeypatch.setattr("agent.API_RETRY_DELAY", 0)
+    session = _FakeSession(*responses)
+    assert await _get_json(session, "https://api.example.com", {}) == expected
+    assert session.requests == requests
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ("instruction_id", "payload", "expected"),
+    [
+        (101, {"instruction": "Be brief.", "mcp_servers": None}, ("Be brief.", [])),
+        (
+            102,
+            {"instruction": None, "mcp_servers": "wss://mcp.example.com"},
+            (FALLBACK_INSTRUCTION, []),
+        ),
+        (
+            103,
+            {"instruction": 42, "mcp_servers": {"name": "tools"}},
+            (FALLBACK_INSTRUCTION, []),
+        ),
+    ],
+)
+async def test_fetch_instruction_normalizes_payload(
+    instruction_id: int, payload: dict, expected: tuple[str, list]
+) -> None:
+    """Null or wrongly typed instruction/mcp_servers fall back to the defaults."""
+    result = await fetch_instruction(
+        instruction_id, 1, _FakeSession(_FakeResponse(payload))
+    )
+    assert result == expected
+
+
+def test_log_metrics_throttled_per_type(monkeypatch: pytest.MonkeyPatch) -> None:
+    """A VAD tick doesn't suppress realtime metrics, repeats of one type are throttled."""
+    logged: list = []
+    monkeypatch.setattr(metrics, "log_metrics", logged.append)
+    vad = metrics.VADMetrics.model_construct()
+    realtime = metrics.RealtimeModelMetrics.model_construct()
+    last_logged: dict = {}
+
+    _log_metrics_throttled(last_logged, vad)
+    _log_metrics_throttled(last_logged, realtime)
+    _log_metrics_throttled(last_logged, realtime)
+
+    assert logged == [vad, realtime]